@@ -1,73 +1,343 @@
 import os
 import asyncio
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+from collections import deque
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 import faiss
 import numpy as np
 import json
 
+logger = logging.getLogger(__name__)
+
+_backoff = wait_exponential(min=1, max=30)
+# Longest we honour a server's Retry-After, so one header can't park a worker for minutes
+RETRY_AFTER_MAX = 60.0
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry dropped connections, rate limits (429) and server-side 5xx errors."""
+    if isinstance(exc, APIConnectionError):
+        return True
+    if isinstance(exc, APIStatusError):
+        if exc.status_code == 429:
+            # An exhausted quota is also sent as 429, but waiting won't fix it
+            return exc.code != "insufficient_quota"
+        return exc.status_code >= 500
+    return False
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Exponential backoff, stretched to the server's Retry-After header (up to RETRY_AFTER_MAX)."""
+    backoff = _backoff(retry_state)
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(max(float(header), backoff), RETRY_AFTER_MAX)
+    except (TypeError, ValueError):
+        return backoff
+
+
+# Shared policy for every OpenAI call; reraise so callers see the original error
+_openai_retry = retry(
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
+
+
 class AIAnalyzer:
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    EMBEDDING_DIM = 1536  # matches text-embedding-3-small
+    # Below this many vectors an HNSW graph beats training an IVF index
+    IVF_MIN_VECTORS = 10_000
+    # Max embedding batches in flight at once — keeps bursts under the RPM limit
+    MAX_IN_FLIGHT = 5
+    # Root-cause answers are reused for prompts at least this similar (cosine)
+    SEMANTIC_CACHE_THRESHOLD = 0.9
+    SEMANTIC_CACHE_SIZE = 256
+    # Embedding cache keeps at most this many vectors (~6 KB each); oldest written go first
+    EMBED_CACHE_MAX_ROWS = 100_000
+    # Saved FAISS indexes kept on disk; oldest written go first
+    FAISS_INDEX_MAX_SAVED = 20
+
     def __init__(self):
         load_dotenv()  # Load environment variables from .env file
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Retries are handled by _openai_retry, so disable the client's built-in ones
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
         self.index = None
         self.id_map = {}
 
+        # Content-addressed embedding cache: hash(model + text) → float32 vector bytes.
+        # Identical log lines recur constantly, so most lookups never reach the API.
+        # Several processes may share the file: WAL lets readers run alongside a
+        # writer, and the timeout waits out a busy writer instead of failing at once.
+        try:
+            self.cache = sqlite3.connect(
+                os.getenv("EMBED_CACHE_PATH", "./.embed_cache"), timeout=5.0, check_same_thread=False
+            )
+            self.cache.execute("PRAGMA journal_mode=WAL")
+            self.cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+            self.cache.commit()
+        except sqlite3.Error as e:
+            # An unusable cache file must not stop the API from starting — embed without it
+            logger.warning("Embedding cache disabled: %s", e)
+            self.cache = None
+        # Cache I/O runs in worker threads (asyncio.to_thread) so a busy
+        # database never blocks the event loop; one connection, one user at a time
+        self.cache_lock = threading.Lock()
+
+        # Semantic cache for root-cause answers: (model, unit prompt vector, analysis)
+        self.semantic_cache = deque(maxlen=self.SEMANTIC_CACHE_SIZE)
+
+        # Built FAISS indexes are saved here, keyed by a hash of the dataset
+        self.index_dir = os.getenv("FAISS_INDEX_DIR", "./.faiss_index")
+
+    def _cache_key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.EMBEDDING_MODEL}\0{text}".encode("utf-8")).hexdigest()
+
+    def _cache_get(self, keys: list[str]) -> dict:
+        found = {}
+        if self.cache is None:
+            return found
+        unique_keys = list(set(keys))
+        try:
+            with self.cache_lock:
+                # Stay under SQLite's bound-parameter limit
+                for i in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[i:i+500]
+                    rows = self.cache.execute(
+                        f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        except sqlite3.Error as e:
+            # The cache is best-effort: whatever was not found gets embedded again
+            logger.warning("Embedding cache read failed: %s", e)
+        return found
+
+    def _cache_put(self, entries: dict):
+        if not entries or self.cache is None:
+            return
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in entries.items()]
+        with self.cache_lock:
+            try:
+                self.cache.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", rows)
+                # Rewritten rows get a new rowid, so the lowest rowids are the oldest writes
+                self.cache.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (self.EMBED_CACHE_MAX_ROWS,)
+                )
+                self.cache.commit()
+            except sqlite3.Error as e:
+                # A failed write only costs a future cache miss
+                self.cache.rollback()
+                logger.warning("Embedding cache write failed: %s", e)
+
+    @_openai_retry
+    async def _create_embeddings(self, batch: list[str]) -> list[list[float]]:
+        response = await self.client.embeddings.create(
+            model=self.EMBEDDING_MODEL,
+            input=batch
+        )
+        return [item.embedding for item in response.data]
+
+    @_openai_retry
+    async def _create_chat_completion(self, **kwargs):
+        return await self.client.chat.completions.create(**kwargs)
+
     async def generate_embeddings(self, texts: list[str]) -> list[list[float]]:
         """
         Generate embeddings for a list of text inputs.
+        Repeated texts are embedded once and cached vectors are reused; only
+        misses are sent to OpenAI, in batches of 100 sent concurrently and
+        bounded by MAX_IN_FLIGHT.
         """
-        batches = [texts[i:i+100] for i in range(0, len(texts), 100)]
+        # The same log line often appears many times — hash and embed each distinct one once
+        keys = {text: self._cache_key(text) for text in dict.fromkeys(texts)}
+        vectors = await asyncio.to_thread(self._cache_get, list(keys.values()))
+        miss_texts = [text for text, key in keys.items() if key not in vectors]
+
+        batches = [miss_texts[i:i+100] for i in range(0, len(miss_texts), 100)]
         total_batches = len(batches)
-        embeddings = []
+        sem = asyncio.Semaphore(self.MAX_IN_FLIGHT)
 
-        for i, batch in enumerate(batches):
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch
-            )
-            batch_embeddings = [item.embedding for item in response.data]
-            embeddings.extend(batch_embeddings)
-            print(f"Embedded batch {i+1}/{total_batches}...")
+        async def _embed(i, batch):
+            # Retries happen inside the semaphore so they still count as in flight
+            async with sem:
+                batch_embeddings = await self._create_embeddings(batch)
+            logger.debug("Embedded batch %d/%d", i + 1, total_batches)
+            return i, batch_embeddings
+
+        # Pre-allocate so results land in input order regardless of completion order
+        results = [None] * total_batches
+        for i, batch_embeddings in await asyncio.gather(*[_embed(i, b) for i, b in enumerate(batches)]):
+            results[i] = batch_embeddings
 
-        return embeddings
+        fresh = {}
+        position = 0
+        for batch_embeddings in results:
+            for embedding in batch_embeddings:
+                fresh[keys[miss_texts[position]]] = embedding
+                position += 1
+        await asyncio.to_thread(self._cache_put, fresh)
+        logger.info("Embedded %d texts (%d distinct, %d cache hits, %d batches)",
+                    len(texts), len(keys), len(keys) - len(miss_texts), total_batches)
+        vectors.update(fresh)
+
+        return [vectors[keys[text]] for text in texts]
+
+    async def _prompt_embedding(self, text: str) -> np.ndarray:
+        """
+        Unit-length embedding of a prompt for the semantic cache.
+        Uses the embedding cache, but makes a single API attempt on a miss —
+        a best-effort lookup must not stall the analysis behind retries.
+        """
+        key = self._cache_key(text)
+        embedding = (await asyncio.to_thread(self._cache_get, [key])).get(key)
+        if embedding is None:
+            response = await self.client.embeddings.create(model=self.EMBEDDING_MODEL, input=[text])
+            embedding = response.data[0].embedding
+            await asyncio.to_thread(self._cache_put, {key: embedding})
+        prompt_vec = np.array(embedding, dtype=np.float32)
+        prompt_vec /= np.linalg.norm(prompt_vec) or 1.0
+        return prompt_vec
+
+    def _semantic_lookup(self, model: str, prompt_vec: np.ndarray) -> dict | None:
+        for cached_model, cached_vec, analysis in self.semantic_cache:
+            if cached_model == model and float(cached_vec @ prompt_vec) >= self.SEMANTIC_CACHE_THRESHOLD:
+                return dict(analysis)
+        return None
 
     def build_faiss_index(self, embeddings, log_ids: list[str]):
         """
         Build a FAISS index for efficient similarity search.
+        An index saved earlier for the same log IDs is loaded instead of rebuilt.
         """
-        # Create FAISS index with 1536 dimensions (matches text-embedding-3-small)
-        index = faiss.IndexFlatIP(1536)
+        dataset_key = hashlib.blake2b(
+            "\0".join([self.EMBEDDING_MODEL, *log_ids]).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        if self.load_index(dataset_key):
+            return
+
+        # Contiguous float32 copy so faiss can scan it with SIMD and normalize in place
         np_array = np.array(embeddings, dtype=np.float32)
+        # Unit vectors make inner product = cosine, which survives quantization well
+        faiss.normalize_L2(np_array)
+
+        if len(np_array) < self.IVF_MIN_VECTORS:
+            # Small corpus: graph search over FP16 codes, half the bytes of float32
+            index = faiss.IndexHNSWSQ(
+                self.EMBEDDING_DIM, faiss.ScalarQuantizer.QT_fp16, 32, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
+            index.train(np_array)
+        else:
+            # Large corpus: inverted lists over 8-bit codes, 4x less memory to scan
+            nlist = max(64, int(math.sqrt(len(np_array))))
+            quantizer = faiss.IndexFlatIP(self.EMBEDDING_DIM)
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, self.EMBEDDING_DIM, nlist,
+                faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(np_array)
+            index.nprobe = 8
+
         index.add(np_array)
         self.index = index
         self.id_map = {i: log_id for i, log_id in enumerate(log_ids)}
+        self.save_index(dataset_key)
+
+    def save_index(self, dataset_key: str):
+        """
+        Write the index and its ID map to disk, keeping at most
+        FAISS_INDEX_MAX_SAVED indexes. Best-effort: the index in memory
+        is usable whether or not the write succeeds.
+        """
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            path = os.path.join(self.index_dir, dataset_key)
+            faiss.write_index(self.index, f"{path}.faiss")
+            with open(f"{path}.json", "w") as f:
+                json.dump([self.id_map[i] for i in range(len(self.id_map))], f)
+            self._prune_indexes()
+        except (OSError, RuntimeError) as e:
+            # faiss reports I/O problems as RuntimeError
+            logger.warning("Could not save FAISS index %s: %s", dataset_key, e)
+
+    def _prune_indexes(self):
+        """Delete the oldest saved indexes beyond FAISS_INDEX_MAX_SAVED."""
+        saved = [
+            os.path.join(self.index_dir, name[:-len(".faiss")])
+            for name in os.listdir(self.index_dir) if name.endswith(".faiss")
+        ]
+        if len(saved) <= self.FAISS_INDEX_MAX_SAVED:
+            return
+        saved.sort(key=lambda path: os.path.getmtime(f"{path}.faiss"))
+        for path in saved[:-self.FAISS_INDEX_MAX_SAVED]:
+            for suffix in (".faiss", ".json"):
+                try:
+                    os.remove(f"{path}{suffix}")
+                except FileNotFoundError:
+                    # Another process pruned it first
+                    pass
+
+    def load_index(self, dataset_key: str) -> bool:
+        """
+        Load the index saved for dataset_key.
+        Returns False when there is nothing to load.
+        """
+        try:
+            path = os.path.join(self.index_dir, dataset_key)
+            index = faiss.read_index(f"{path}.faiss")
+            with open(f"{path}.json") as f:
+                log_ids = json.load(f)
+        except (OSError, RuntimeError, ValueError):
+            # Missing or unreadable files — faiss reports I/O problems as RuntimeError
+            return False
+        self.index = index
+        self.id_map = {i: log_id for i, log_id in enumerate(log_ids)}
+        return True
 
     async def search_similar(self, query: str, k=5) -> list[str]:
         """
         Find the top k most similar log entries to the given query.
         """
-        # Generate query embedding
-        response = self.client.embeddings.create(
-            model="text-embedding-3-small",
-            input=[query]
-        )
-        query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
+        return (await self.search_similar_batch([query], k))[0]
 
+    async def search_similar_batch(self, queries: list[str], k=5) -> list[list[str]]:
+        """
+        Find the top k most similar log entries for each query.
+        All queries are embedded together and searched with a single
+        index.search call, which faiss runs as one BLAS matrix product
+        once there are 20 or more of them.
+        """
         if self.index is None:
-            return []
+            return [[] for _ in queries]
+
+        # Generate query embeddings as one (Q, dim) float32 matrix
+        query_embeddings = np.array(await self.generate_embeddings(queries), dtype=np.float32)
+        faiss.normalize_L2(query_embeddings)
 
         # Search for nearest neighbors
-        distances, indices = self.index.search(query_embedding, k)
+        distances, indices = self.index.search(query_embeddings, k)
 
-        # Extract corresponding log IDs
-        log_ids = [self.id_map[i] for i in indices[0]]
-        return log_ids
+        # Extract corresponding log IDs (approximate indexes pad short results with -1)
+        return [[self.id_map[i] for i in row if i != -1] for row in indices]
 
-    async def analyze_root_cause(self, logs, model="gpt-4o"):
+    async def analyze_root_cause(self, logs, model="gpt-4o-mini"):
         """
         Analyze logs using selected AI model to determine root cause and provide solutions.
-        Supports gpt-4o, gpt-4-turbo, and gpt-3.5-turbo.
+        Supports gpt-4o, gpt-4o-mini, gpt-4-turbo, and gpt-3.5-turbo — all run in
+        JSON mode, so the reply is always a parseable JSON object.
         """
         # Format logs into a string for the model
         formatted_logs = "\n\n".join([
@@ -93,21 +363,38 @@ class AIAnalyzer:
             """}
         ]
 
+        # Reuse a previous answer when an almost identical set of logs was analyzed.
+        # The cache is only an optimization: if the embedding fails, go straight to the model.
+        try:
+            prompt_vec = await self._prompt_embedding(formatted_logs)
+            cached = self._semantic_lookup(model, prompt_vec)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning("Semantic cache lookup skipped: %s", e)
+            prompt_vec = None
+
         try:
             # Call the Chat Completion API
-            response = self.client.chat.completions.create(
+            response = await self._create_chat_completion(
                 model=model,
                 messages=messages,
-                response_format={ "type": "json_object" } if model in ["gpt-4o", "gpt-4-turbo"] else None,
+                response_format={"type": "json_object"},
                 max_tokens=800,
-                temperature=0.3
+                # Low temperature keeps answers stable, which also helps the semantic cache
+                temperature=0.2
             )
-            
-            # Parse the response
+            if response.usage is not None:
+                logger.info("Root-cause analysis with %s used %d prompt + %d completion tokens",
+                            model, response.usage.prompt_tokens, response.usage.completion_tokens)
+
+            # JSON mode guarantees valid JSON; errors below are API failures
             content = response.choices[0].message.content
             analysis = json.loads(content)
+            if prompt_vec is not None:
+                self.semantic_cache.append((model, prompt_vec, dict(analysis)))
         except Exception as e:
-            print(f"AI Analysis error with {model}: {e}")
+            logger.exception("AI analysis error with %s: %s", model, e)
             analysis = {
                 "cause": "Manual review required: AI analysis encountered an error.",
                 "impact": "Unconfirmed",
@@ -1,8 +1,9 @@
-import statistics
-from collections import defaultdict
+import numpy as np
+import pandas as pd
 from typing import List, Dict, Any
 from datetime import datetime
 
+
 class AnomalyDetector:
     # Constants for anomaly detection tuning
     MIN_STD_OFFSET = 0.001  # Avoid division by zero
@@ -33,75 +34,84 @@ class AnomalyDetector:
         # Input validation
         if not logs:
             return []
-        
+
+        df = self._frame(logs)
+        scores = self._lookup(self.score_buckets(self._count(df)), df)
+
+        for log, score in zip(logs, scores.tolist()):
+            log['anomaly_score'] = score
+
+        return logs
+
+    # ── Chunked scoring ──────────────────────────────────────
+    # A file split into chunks is scored without holding it in memory: add
+    # up bucket_counts() of every chunk and turn the total into
+    # score_buckets(). The statistics still cover the whole file, so a
+    # bucket's score equals what compute_anomaly_score() gives its logs.
+    # The worker writes the scores onto the stored logs by (service, hour).
+
+    def bucket_counts(self, logs: List[Dict]) -> pd.DataFrame:
+        """
+        Count logs and ERRORs per (service, hour) bucket.
+
+        Counts of different chunks can be summed with
+        ``a.add(b, fill_value=0)``.
+
+        Raises:
+            KeyError / TypeError: Same validation as compute_anomaly_score.
+        """
+        return self._count(self._frame(logs))
+
+    def score_buckets(self, counts: pd.DataFrame) -> pd.Series:
+        """Anomaly score of every (service, hour) bucket, from bucket_counts()."""
+        # Error rate of every (service, hour) bucket
+        rates = counts['errors'] / counts['total']
+
+        # Mean and standard deviation of each service's hourly error rates, broadcast
+        # back onto its buckets. A service with a single bucket has std 0.
+        # Design note: grouping by hour only mixes patterns across days (e.g., Mon 3am with Fri 3am).
+        # For daily patterns, consider using (date, hour) tuples instead.
+        stats = rates.groupby(level='service', sort=False, dropna=False).agg(['mean', 'std'])
+        stats['std'] = stats['std'].fillna(0.0)
+        # One division per service; the per-bucket Z-score below only multiplies
+        stats['inv_std'] = 1.0 / (stats['std'] + self.MIN_STD_OFFSET)
+        per_bucket = stats.reindex(rates.index.get_level_values('service'))
+        mean = per_bucket['mean'].to_numpy()
+        std = per_bucket['std'].to_numpy()
+        inv_std = per_bucket['inv_std'].to_numpy()
+        rate = rates.to_numpy()
+
+        # Compute Z-score: how many standard deviations from the mean
+        z_score = (rate - mean) * inv_std
+
+        # Buckets beyond the anomaly threshold (2σ) score 1.0, the rest use the
+        # Z-score normalized to [0, 1]
+        np.clip(z_score, 0.0, 1.0, out=z_score)
+        z_score[rate > mean + self.ANOMALY_Z_THRESHOLD * std] = 1.0
+        return pd.Series(z_score, index=rates.index)
+
+    def _frame(self, logs: List[Dict]) -> pd.DataFrame:
+        """Validate logs and build a (service, hour, is_err) frame from them."""
         required_keys = {'service', 'timestamp', 'level'}
         for log in logs:
             if not required_keys.issubset(log.keys()):
                 raise KeyError(f"Log missing required field(s): {required_keys - log.keys()}")
             if not isinstance(log['timestamp'], datetime):
                 raise TypeError(f"Expected datetime for 'timestamp', got {type(log['timestamp'])}")
-        # Group logs by service name
-        services = defaultdict(list)
-        for log in logs:
-            service = log['service']
-            services[service].append(log)
-        
-        # Process each service
-        for service, service_logs in services.items():
-            # Group logs into hourly buckets
-            hourly_buckets = defaultdict(list)
-            for log in service_logs:
-                # Extract hour from timestamp
-                hour = log['timestamp'].hour
-                hourly_buckets[hour].append(log)
-            
-            # Compute error rates for each bucket
-            # Note: assumes parser normalizes levels to uppercase (e.g., 'ERROR', 'WARN', 'INFO')
-            hour_to_error_rate = {}
-            for hour, logs_in_bucket in hourly_buckets.items():
-                errors_count = sum(1 for log in logs_in_bucket if log['level'] == 'ERROR')
-                total_logs = len(logs_in_bucket)
-                error_rate = errors_count / total_logs if total_logs > 0 else 0.0
-                hour_to_error_rate[hour] = error_rate
-            
-            # Collect all error rates for the service
-            error_rates = list(hour_to_error_rate.values())
-            
-            # Compute mean and standard deviation
-            # Design note: grouping by hour only mixes patterns across days (e.g., Mon 3am with Fri 3am).
-            # For daily patterns, consider using (date, hour) tuples instead.
-            if not error_rates:
-                # No logs with this service in this batch — skip
-                continue
-            
-            if len(error_rates) < 2:
-                mean = error_rates[0]
-                std = 0.0
-            else:
-                try:
-                    mean = statistics.mean(error_rates)
-                    std = statistics.stdev(error_rates)
-                except statistics.StatisticsError:
-                    mean = statistics.mean(error_rates)
-                    std = 0.0
-            
-            # Now, compute score for each log in service_logs
-            for log in service_logs:
-                hour = log['timestamp'].hour
-                error_rate = hour_to_error_rate[hour]
-                
-                # Compute Z-score: how many standard deviations from the mean
-                denominator = std + self.MIN_STD_OFFSET
-                z_score = (error_rate - mean) / denominator
-                
-                # Check if this hour's error rate exceeds the anomaly threshold (2σ)
-                if error_rate > mean + self.ANOMALY_Z_THRESHOLD * std:
-                    score = 1.0
-                else:
-                    # Use Z-score normalized to [0, 1)
-                    score = z_score
-                    score = max(0.0, min(1.0, score))
-                
-                log['anomaly_score'] = score
-        
-        return logs
+        # Columnar view of the fields the score depends on. The hour is read
+        # per datetime: .dt.hour fails on a mix of tz-aware and naive timestamps.
+        df = pd.DataFrame(logs, columns=['service', 'level'])
+        df['hour'] = [log['timestamp'].hour for log in logs]
+        # Note: assumes parser normalizes levels to uppercase (e.g., 'ERROR', 'WARN', 'INFO')
+        df['is_err'] = df['level'].to_numpy() == 'ERROR'
+        return df
+
+    def _count(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Per-bucket totals: columns 'total' and 'errors', indexed by (service, hour)."""
+        # dropna=False keeps logs without a service in a bucket of their own
+        return df.groupby(['service', 'hour'], sort=False, dropna=False)['is_err'].agg(total='size', errors='sum')
+
+    def _lookup(self, bucket_scores: pd.Series, df: pd.DataFrame) -> np.ndarray:
+        """Look up each row's bucket score."""
+        row_keys = pd.MultiIndex.from_arrays([df['service'], df['hour']])
+        return bucket_scores.reindex(row_keys).to_numpy()
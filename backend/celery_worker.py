@@ -1,14 +1,20 @@
 import os
+import asyncio
+import logging
 import json
-from celery import Celery
-from pymongo import MongoClient
+from datetime import datetime
+from itertools import islice
+import pandas as pd
+from celery import Celery, chord
+from celery.signals import worker_process_init
+from pymongo import MongoClient, UpdateMany
+from pymongo.errors import BulkWriteError
 # Use direct imports (not 'backend.parser') because this file IS inside the backend dir
 from parser import LogParser
 from anomaly import AnomalyDetector
-try:
-    from ai_analysis import AIAnalyzer
-except Exception:
-    AIAnalyzer = None
+from database import init_db
+
+logger = logging.getLogger(__name__)
 
 # ─────────────────────────────────────────────────────────────
 # Celery app — uses Redis as broker AND result backend
@@ -28,53 +34,218 @@ client = MongoClient(_mongo_uri)
 db = client["log_platform"]
 
 
+# ─────────────────────────────────────────────────────────────
+# Per-process singletons — built once per worker process and reused by
+# every task it runs (compiled regexes, detector settings)
+# ─────────────────────────────────────────────────────────────
+PARSER = None
+DETECTOR = None
+
+
+def _components():
+    """Return the shared (parser, detector), creating them on first use."""
+    global PARSER, DETECTOR
+    if PARSER is None:
+        PARSER = LogParser()
+        DETECTOR = AnomalyDetector()
+    return PARSER, DETECTOR
+
+
+@worker_process_init.connect
+def init_worker(**kwargs):
+    # Build the singletons when a worker process starts, not inside the first task
+    _components()
+    # Same idempotent collection/index setup the API runs on startup,
+    # in case the worker comes up first
+    try:
+        asyncio.run(init_db())
+    except Exception as e:
+        logger.warning("Database init skipped or failed: %s", e)
+
+
+# Lines per parse_log_chunk task — each chunk can run on a different worker
+CHUNK_SIZE = 10_000
+# Documents per insert_many call
+INSERT_BATCH_SIZE = 5_000
+# MongoDB duplicate-key error code
+DUPLICATE_KEY = 11000
+
+
+def _chunked(iterable, size):
+    """Yield lists of up to `size` items from an iterator."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _insert_logs(logs) -> int:
+    """
+    Bulk-insert logs in INSERT_BATCH_SIZE batches and return how many were stored.
+    Unordered inserts let the server apply a batch in parallel and keep going
+    past duplicate keys; any other write error is re-raised.
+    """
+    inserted = 0
+    for batch in _chunked(logs, INSERT_BATCH_SIZE):
+        try:
+            result = db.logs.insert_many(batch, ordered=False, bypass_document_validation=True)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+                raise
+            inserted += e.details.get("nInserted", 0)
+    return inserted
+
+
+def _mark_failed(job_id: str, error: str):
+    # Mark job failed so the API can report what went wrong
+    db.jobs.update_one(
+        {"job_id": job_id},
+        {
+            "$set": {
+                "status": "failed",
+                "error": error,
+            }
+        },
+    )
+
+
 @celery_app.task(name="process_log_file")
 def process_log_file(job_id: str, content: str, filename: str):
     """
     Background task: parse → detect anomalies → store results in MongoDB.
     This runs inside the Celery worker container, NOT in the web server.
+
+    The file is split into CHUNK_SIZE-line pieces and fanned out as a chord:
+    one parse_log_chunk task per piece (parse + store, in parallel across
+    workers), then finalize_log_file once all of them are done (score +
+    mark completed). How many chunks run at once is bounded by the worker
+    concurrency, which keeps MongoDB from being flooded.
     """
     try:
-        # ── 1. Parse log lines ──────────────────────────────────
-        parser = LogParser()
-        # content is a str (decoded by the API before handing to Celery)
-        parsed_logs = parser.parse_file(content)
-
-        # ── 2. Detect anomalies ───────────────────────────────
-        # AnomalyDetector.compute_anomaly_score() adds 'anomaly_score' to each log
-        detector = AnomalyDetector()
-        try:
-            scored_logs = detector.compute_anomaly_score(parsed_logs)
-        except Exception:
-            # If scoring fails, still store the parsed logs without scores
-            scored_logs = parsed_logs
-
-        # ── 3. Store each log entry in MongoDB ────────────────
-        if scored_logs:
-            db.logs.insert_many(scored_logs)
-
-        # ── 4. Mark job completed ─────────────────────────────
-        db.jobs.update_one(
-            {"job_id": job_id},
-            {
-                "$set": {
-                    "status": "completed",
-                    "processed_count": len(scored_logs),
-                    "filename": filename,
-                }
-            },
-        )
+        # content is a str (decoded by the API before handing to Celery).
+        # The API and worker run in separate containers, so the text
+        # travels in the message rather than as a file path.
+        # splitlines() breaks on the same separators as parse_file (\r, \x0b, \u2028, ...);
+        # keepends lets each chunk be re-split into exactly the same lines
+        chunks = ["".join(lines) for lines in _chunked(content.splitlines(keepends=True), CHUNK_SIZE)]
+        # One clock for every chunk, so lines without a timestamp share an hour bucket
+        now = datetime.now().isoformat()
+
+        db.jobs.update_one({"job_id": job_id}, {"$set": {"status": "processing"}})
+        if not chunks:
+            finalize_log_file([], job_id, filename)
+            return
+
+        chord(
+            (parse_log_chunk.s(job_id, chunk, now) for chunk in chunks),
+            finalize_log_file.s(job_id, filename).on_error(mark_job_failed.s(job_id)),
+        ).apply_async()
 
     except Exception as e:
-        # Mark job failed so the API can report what went wrong
-        db.jobs.update_one(
-            {"job_id": job_id},
-            {
-                "$set": {
-                    "status": "failed",
-                    "error": str(e),
-                }
-            },
-        )
+        _mark_failed(job_id, str(e))
         # Re-raise so Celery marks the task as FAILURE (visible in Flower)
         raise
+
+
+@celery_app.task(name="parse_log_chunk")
+def parse_log_chunk(job_id: str, text: str, now: str) -> dict:
+    """
+    Parse one chunk of a file and store its logs, tagged with job_id.
+
+    Anomaly scores need statistics over the whole file, so instead of
+    scoring here the chunk returns its error counts per (service, hour)
+    as [service, hour, total, errors] rows for finalize_log_file to merge.
+    """
+    parser, detector = _components()
+    parsed_logs = parser.iter_parse(text.splitlines(), now=datetime.fromisoformat(now))
+
+    # last_matched names the format of the line iter_parse just yielded
+    tagged = ((log, parser.last_matched) for log in parsed_logs)
+
+    inserted = 0
+    counts = None
+    for pairs in _chunked(tagged, INSERT_BATCH_SIZE):
+        batch = [log for log, _ in pairs]
+        try:
+            batch_counts = detector.bucket_counts(batch)
+            counts = batch_counts if counts is None else counts.add(batch_counts, fill_value=0)
+        except Exception:
+            # If counting fails, the logs are still stored — just never scored
+            pass
+        for log, matched in pairs:
+            log["job_id"] = job_id
+            # Only drop the raw text when the parsed fields can rebuild it;
+            # for every other format it is the only copy of the original event
+            if matched in parser.LOSSLESS_FORMATS:
+                del log["raw_line"]
+        stored = _insert_logs(batch)
+        inserted += stored
+        # Live progress on the job document
+        db.jobs.update_one({"job_id": job_id}, {"$inc": {"processed_count": stored}})
+
+    rows = []
+    if counts is not None:
+        rows = [
+            [service, hour, int(total), int(errors)]
+            for (service, hour), total, errors in zip(
+                counts.index.tolist(), counts["total"].tolist(), counts["errors"].tolist()
+            )
+        ]
+    return {"inserted": inserted, "counts": rows}
+
+
+@celery_app.task(name="finalize_log_file")
+def finalize_log_file(results: list, job_id: str, filename: str):
+    """
+    Chord callback: merge the chunk counts, score every (service, hour)
+    bucket against whole-file statistics, write the scores onto the job's
+    logs and mark the job completed.
+    """
+    processed_count = sum(result["inserted"] for result in results)
+
+    rows = [row for result in results for row in result["counts"]]
+    if rows:
+        try:
+            counts = (
+                pd.DataFrame(rows, columns=["service", "hour", "total", "errors"])
+                .groupby(["service", "hour"], sort=False, dropna=False).sum()
+            )
+            _, detector = _components()
+            bucket_scores = detector.score_buckets(counts)
+
+            # One update per service: each log picks its score out of a
+            # 24-slot list by the hour of its own timestamp
+            hour_scores = {}
+            for (service, hour), score in bucket_scores.items():
+                hour_scores.setdefault(service, [0.0] * 24)[hour] = float(score)
+            db.logs.bulk_write(
+                [
+                    UpdateMany(
+                        {"job_id": job_id, "service": service},
+                        [{"$set": {"anomaly_score": {"$arrayElemAt": [scores, {"$hour": "$timestamp"}]}}}],
+                    )
+                    for service, scores in hour_scores.items()
+                ],
+                ordered=False,
+            )
+        except Exception:
+            # If scoring fails, the parsed logs stay stored without scores
+            pass
+
+    # ── Mark job completed ─────────────────────────────────
+    db.jobs.update_one(
+        {"job_id": job_id},
+        {
+            "$set": {
+                "status": "completed",
+                "processed_count": processed_count,
+                "filename": filename,
+            }
+        },
+    )
+
+
+@celery_app.task(name="mark_job_failed")
+def mark_job_failed(request, exc, traceback, job_id: str):
+    """Chord error callback: a chunk task failed, so the job did too."""
+    _mark_failed(job_id, str(exc))
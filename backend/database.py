@@ -15,6 +15,20 @@ class Database:
         self.client = AsyncIOMotorClient(self.uri)
         self.db = self.client.get_database("log_platform")
 
+    async def create_collections(self):
+        """Create the logs collection with zstd block compression"""
+        try:
+            # Log text is highly repetitive, so zstd shrinks it far more than the
+            # default snappy. Compression is fixed when a collection is created,
+            # so this must run before anything (e.g. create_index) creates it implicitly.
+            if "logs" not in await self.db.list_collection_names():
+                await self.db.create_collection(
+                    "logs",
+                    storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+                )
+        except Exception as e:
+            print(f"Warning: Collection creation skipped or failed: {e}")
+
     async def create_indexes(self):
         """Create optimized indexes for common queries"""
         try:
@@ -28,6 +42,15 @@ class Database:
                 name="service_timestamp_level_idx"
             )
             
+            # Per-job lookups — the worker scores a job's logs service by service
+            await self.db.logs.create_index(
+                [
+                    ("job_id", ASCENDING),
+                    ("service", ASCENDING)
+                ],
+                name="job_service_idx"
+            )
+            
             # TTL index for automatic log expiration
             await self.db.logs.create_index(
                 [
@@ -57,7 +80,16 @@ class Database:
 
 # Initialize database connection
 db = Database()
+_initialized = False
+
 # Note: In production, indexes are usually created via a migration script or on startup
-# We avoid top-level asyncio.run here to prevent issues with existing event loops
+# We avoid top-level asyncio.run here to prevent issues with existing event loops.
+# Call this from the FastAPI startup event or a Celery worker init hook instead.
 async def init_db():
-    await db.create_indexes()
\ No newline at end of file
+    """Create collections and indexes — at most once per process"""
+    global _initialized
+    if _initialized:
+        return
+    await db.create_collections()
+    await db.create_indexes()
+    _initialized = True
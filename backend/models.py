@@ -11,7 +11,8 @@ class LogDocument(BaseModel):
     host: str = Field(..., description="Hostname of the machine where the log originated")
     trace_id: Optional[str] = Field(None, description="Correlation ID for distributed systems")
     anomaly_score: float = Field(0.0, description="AI-assigned score for potential anomalies")
-    raw_line: str = Field(..., description="Original log line from the source")
+    raw_line: Optional[str] = Field(None, description="Original log line; omitted for app-format lines, whose fields hold all of it")
+    job_id: Optional[str] = Field(None, description="Upload job that produced this log")
 
 class UploadResponse(BaseModel):
     job_id: str = Field(..., description="Unique identifier for the upload job")
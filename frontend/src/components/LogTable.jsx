@@ -155,7 +155,7 @@ export default function LogTable({
                             Full Transmission Log
                           </div>
                           <pre className="text-xs font-mono text-white/60 whitespace-pre-wrap leading-relaxed">
-                            {log.raw_line || JSON.stringify(log, null, 2)}
+                            {log.raw_line || log.message || JSON.stringify(log, null, 2)}
                           </pre>
                         </div>
                       </td>